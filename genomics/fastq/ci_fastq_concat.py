@@ -27,10 +27,53 @@ Output:
 """
 
 import os
+import re
+import errno
 import sys
-import glob
-from subprocess import call
+import shutil
+import fnmatch
 import argparse
+from collections import defaultdict
+
+# FASTQ filename pattern, translated to a regex once rather than per file
+_FQ_RE = re.compile(fnmatch.translate("*_r?_*_s?.fq.gz"))
+# sendfile between regular files is Linux-only (macOS needs a socket target)
+_USE_SENDFILE = sys.platform.startswith("linux")
+# os.link errors meaning "no hard link here" (other device, or the filesystem
+# does not support or allow them), where copying is the right fallback
+_NO_LINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+def concat_files(out_path, files):
+    # Byte-wise concatenation (valid for gzip, members concatenate). On Linux
+    # sendfile keeps the data in the kernel; elsewhere copy with a 1 MB buffer.
+    # An existing output may be a hard link to an input lane file (see
+    # link_or_copy), so unlink it rather than truncating the shared inode
+    if os.path.lexists(out_path):
+        os.remove(out_path)
+    with open(out_path, "wb") as dst:
+        for src in files:
+            with open(src, "rb") as s:
+                if _USE_SENDFILE:
+                    while os.sendfile(dst.fileno(), s.fileno(), None, 1 << 30):
+                        pass
+                else:
+                    shutil.copyfileobj(s, dst, length=1 << 20)
+
+
+def link_or_copy(src, dst):
+    # Single-file group: hard link instead of copying the bytes, falling back
+    # to a copy where links are not possible (e.g. cross-device)
+    # lexists so a dangling symlink is removed, not followed by the copy
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        shutil.copyfile(src, dst)
+
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Concatenate FASTQ files by group.")
@@ -41,37 +84,42 @@ args = parser.parse_args()
 # Change to the target directory
 os.chdir(args.directory)
 
-# Find all FASTQ files matching the pattern
-fqs = glob.glob(r"*_r?_*_s?.fq.gz")
-
-uniqes = set()
-for fq in fqs:
+# Find all FASTQ files matching the pattern and group them in a single pass
+# Per-file and per-group messages are buffered and written once per loop
+fqs = []
+groups = defaultdict(list)
+log = []
+for entry in os.scandir("."):
+    fq = entry.name
+    # Hidden files are skipped, as glob would
+    if fq.startswith(".") or not _FQ_RE.match(fq):
+        continue
+    fqs.append(fq)
     # Group by all but the last two underscore-separated fields (read, lane)
     name = "_".join(fq.split("_")[:-2])
-    print(f"Processing file: {fq}, base name: {name}")
+    log.append(f"Processing file: {fq}, base name: {name}\n")
     if fq.endswith(".gz"):
         extens = fq.split(".")[-2].replace("fastq", "fq")+".gz"
-        print(f"Detected gzipped file, adding unique {name+'...'+extens}")
+        log.append(f"Detected gzipped file, adding to group {name}.{extens}\n")
     else:
         # error case, abort
+        sys.stdout.write("".join(log))
         raise ValueError(f"File does not end with .gz: {fq}")
-    uniqes.add(name+"..."+extens)
+    groups[(name, extens)].append(fq)
+sys.stdout.write("".join(log))
 
 planned = []
-for unique in uniqes:
-    print(f"Processing group: {unique}")
-    group_name = unique.split("...")[0]
-    print(f"Group name: {group_name}")
-    group_ext = unique.split("...")[-1]
-    # Find all files in this group (matching prefix and extension)
-    copies = sorted([fq for fq in fqs if fq.startswith(group_name) and fq.replace("fastq", "fq").endswith(group_ext)])
-    outname = unique.replace("...", ".")
-    arg_text = "cat "+ " ".join(copies) +" > "+ outname
-    planned.append((copies, outname, arg_text))
+log = []
+for (group_name, group_ext), copies in groups.items():
+    outname = group_name + "." + group_ext
+    log.append(f"Processing group: {outname}\n")
+    log.append(f"Group name: {group_name}\n")
+    planned.append((sorted(copies), outname))
+sys.stdout.write("".join(log))
 
 # Print planned actions
 print("Planned concatenations:")
-for copies, outname, arg_text in planned:
+for copies, outname in planned:
     print(f"{' + '.join(copies)} -> {outname}")
 
 print(f"\nFound {len(fqs)} FASTQ files in directory '{args.directory}':")
@@ -80,8 +128,12 @@ print(f"Total groups to concatenate: {len(planned)}")
 if args.dry_run:
     print("\nDry run complete. No files were concatenated.")
 else:
-    for copies, outname, arg_text in planned:
-        print(f"Running: {arg_text}")
-        call([arg_text], shell=True)
+    for copies, outname in planned:
+        if len(copies) == 1:
+            print(f"Linking: {copies[0]} -> {outname}")
+            link_or_copy(copies[0], outname)
+        else:
+            print(f"Concatenating: {' + '.join(copies)} -> {outname}")
+            concat_files(outname, copies)
     print("\nAll concatenations complete.")
 
@@ -37,6 +37,7 @@ Typical FASTQ filename: SLX12345.xGenUDI30.HJY7KDRXX.s_1.r_1.fq.gz
 
 import os
 import sys
+import csv
 import argparse
 
 # Parse command-line arguments
@@ -51,27 +52,32 @@ target_dir = args.directory
 # Change to the target directory
 os.chdir(target_dir)
 
+# List the directory once; existence checks below are set lookups, not stat calls
+entries = list(os.scandir("."))
+existing = {entry.name for entry in entries}
+existing_files = {entry.name for entry in entries if entry.is_file()}
+
 # Find all .contents.csv files in the directory
-csvs = [file for file in os.listdir("./") if file.endswith(".contents.csv")]
+csvs = [entry.name for entry in entries if entry.name.endswith(".contents.csv")]
 
 problems = []
 planned = []
 
-for csv in csvs:
-    with open(csv) as table:
-        next(table)  # skip header
+for csv_name in csvs:
+    with open(csv_name, newline="") as table:
+        reader = csv.reader(table)
+        next(reader, None)  # skip header
         # Extract SLX, flowcell, and lane from the CSV filename
-        slx = csv.split(".")[0]
-        flowcell = csv.split(".")[1]
-        lane = csv.split("s_")[-1].split(".")[0]
+        slx = csv_name.split(".")[0]
+        flowcell = csv_name.split(".")[1]
+        lane = csv_name.split("s_")[-1].split(".")[0]
 
-        for line in table:
-            cols = line.strip().split(",")
+        for cols in reader:
             if len(cols) < 4:
-                problems.append(f"Malformed line in {csv}: {line.strip()}")
+                problems.append(f"Malformed line in {csv_name}: {','.join(cols)}")
                 continue
             barcode = cols[1]
-            sample = cols[3].replace("-", "_")
+            sample = cols[3].strip().replace("-", "_")
             # Construct old and new filenames for R1 and R2
             old_name_r1 = f"{slx}.{barcode}.{flowcell}.s_{lane}.r_1.fq.gz"
             old_name_r2 = f"{slx}.{barcode}.{flowcell}.s_{lane}.r_2.fq.gz"
@@ -79,20 +85,23 @@ for csv in csvs:
             new_name2 = f"{sample}_r2_{flowcell}_s{lane}.fq.gz"
 
             # Check for problems and plan renames
-            if not os.path.isfile(old_name_r1):
+            if old_name_r1 not in existing_files:
                 problems.append(f"Missing file: {old_name_r1}")
-            elif os.path.exists(new_name1):
+            elif new_name1 in existing:
                 problems.append(f"Target file already exists: {new_name1}")
             else:
                 planned.append((old_name_r1, new_name1))
 
-            if not os.path.isfile(old_name_r2):
+            if old_name_r2 not in existing_files:
                 problems.append(f"Missing file: {old_name_r2}")
-            elif os.path.exists(new_name2):
+            elif new_name2 in existing:
                 problems.append(f"Target file already exists: {new_name2}")
             else:
                 planned.append((old_name_r2, new_name2))
 
+# Rename in source filename order so neighbouring directory entries are touched together
+planned.sort(key=lambda p: p[0])
+
 # Print planned actions and problems
 print("Planned renames:")
 for old, new in planned:
@@ -105,8 +114,14 @@ if problems:
     print("\nNo files will be renamed until problems are resolved.")
 
 if not dry_run and not problems:
-    for old, new in planned:
-        os.rename(old, new)
-        print(f"Renamed {old} --> {new}")
+    # Buffer the log and write it once, even if a rename fails part way
+    renamed = []
+    try:
+        for old, new in planned:
+            os.rename(old, new)
+            renamed.append(f"Renamed {old} --> {new}\n")
+    finally:
+        sys.stdout.write("".join(renamed))
+        sys.stdout.flush()
 elif dry_run:
     print("\nDry run complete. No files were renamed.")
@@ -4,14 +4,15 @@
 Concatenate files by either:
 - exact filename match (from different directories), or
 - prefix grouping (automatically extracts prefix as everything before R1/R2 pattern),
-keeping R1/R2 separate and submitting each concat as a Slurm job or running locally.
+keeping R1/R2 separate and submitting the concats as Slurm array jobs or running locally.
 
 - Output filenames are constructed from the group key and detected read, with configurable formatting.
 - Supports a --dry-run mode.
 - Supports a --local mode for running without Slurm.
+- Supports a --recompress mode that re-deflates each group with pigz into a single stream with 1 MB blocks.
 
 Usage:
-    python general_concat.py "<input_glob>" <outdir> --group-mode {exact,prefix} [--read-style {r,R,r_,R_}] [--dry-run] [--local] [--parallel N]
+    python general_concat.py "<input_glob>" <outdir> --group-mode {exact,prefix} [--read-style {r,R,r_,R_}] [--dry-run] [--local] [--parallel N] [--array-limit N] [--max-array-size N] [--recompress] [--threads N] [--time HH:MM:SS]
 
 Arguments:
     <input_glob>        Glob pattern for input files (in quotes)
@@ -21,6 +22,11 @@ Arguments:
     --dry-run           Only print planned actions, do not submit jobs
     --local             Run locally instead of via Slurm
     --parallel          Number of parallel jobs when using --local (default: 4)
+    --array-limit       Maximum simultaneously running Slurm array tasks (default: no limit)
+    --max-array-size    Maximum tasks per Slurm array job, larger runs are split (default: 1001)
+    --recompress        Decompress and recompress with pigz instead of byte-wise concatenation (requires pigz)
+    --threads           pigz threads per concatenation with --recompress (default: cores / --parallel locally, 4 on Slurm)
+    --time              Slurm time limit per task (default: 00:15:00, or 04:00:00 with --recompress)
 """
 
 import os
@@ -31,13 +37,23 @@ from collections import defaultdict
 import subprocess
 import re
 import time
-from multiprocessing import Pool
+import shutil
+import shlex
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Read pattern in input filenames (R1/R2/r1/r2/R_1/r_1 etc)
+_READ_RE = re.compile(r'([._-])([rR])[_]?([12])(\D|$)')
+# Read part of an output filename, reformatted according to --read-style
+_OUT_READ_RE = re.compile(r'(r[_]?1|R[_]?1|r[_]?2|R[_]?2)')
+# sendfile between regular files is Linux-only (macOS needs a socket target)
+_USE_SENDFILE = sys.platform.startswith('linux')
 
 def detect_read(filename):
     # Detects R1/R2/r1/r2/R_1/r_1 etc, returns (read, prefix)
     # read: 'r1' or 'r2'
     # prefix: everything in filename before the read pattern
-    m = re.search(r'([._-])([rR])[_]?([12])(\D|$)', filename)
+    m = _READ_RE.search(filename)
     if m:
         read = m.group(2).lower() + m.group(3)  # e.g. r1 or r2
         prefix = filename[:m.start()]  # everything before the match
@@ -57,19 +73,60 @@ def format_read(read, style):
     else:
         raise ValueError(f"Unknown read style: {style}")
 
+def concat_files(out_path, files):
+    # Byte-wise concatenation (valid for gzip, members concatenate). On Linux
+    # sendfile keeps the data in the kernel; elsewhere copy with a 1 MB buffer
+    with open(out_path, 'wb') as dst:
+        for src in files:
+            with open(src, 'rb') as s:
+                if _USE_SENDFILE:
+                    while os.sendfile(dst.fileno(), s.fileno(), None, 1 << 30):
+                        pass
+                else:
+                    shutil.copyfileobj(s, dst, length=1 << 20)
+
+def recompress_files(out_path, files, threads):
+    # pigz -dc files | pigz -c -b 1024 > out_path, without going through a shell
+    with open(out_path, 'wb') as dst:
+        decomp = subprocess.Popen(['pigz', '-dc', '-p', str(threads), *files], stdout=subprocess.PIPE)
+        try:
+            comp = subprocess.Popen(['pigz', '-c', '-p', str(threads), '-b', '1024'], stdin=decomp.stdout, stdout=dst)
+        except OSError:
+            # Don't leave the decompressor running with nobody reading its output
+            decomp.kill()
+            decomp.stdout.close()
+            decomp.wait()
+            raise
+        decomp.stdout.close()  # so the decompressor sees SIGPIPE if the compressor dies
+        comp.wait()
+        decomp.wait()
+    for proc in (decomp, comp):
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+def positive_int(value):
+    # argparse type for counts that must be at least 1
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return n
+
 def run_concat_local(task):
     """Run a single concatenation task locally."""
-    out_path, files, out_base = task
-    files_str = " ".join(sorted(files))
-    cmd = f"cat {files_str} > {out_path}"
+    out_path, files, out_base, pigz_threads = task
     
-    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Starting: {out_base}")
+    # Workers are threads sharing sys.stdout; print() writes the newline
+    # separately, so emit each status line in a single write
+    sys.stdout.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Starting: {out_base}\n")
     try:
-        subprocess.run(cmd, shell=True, check=True)
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Finished: {out_base}")
+        if pigz_threads:
+            recompress_files(out_path, files, pigz_threads)
+        else:
+            concat_files(out_path, files)
+        sys.stdout.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Finished: {out_base}\n")
         return (True, out_base)
-    except subprocess.CalledProcessError as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] FAILED: {out_base} - {e}")
+    except (OSError, subprocess.CalledProcessError) as e:
+        sys.stdout.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] FAILED: {out_base} - {e}\n")
         return (False, out_base)
 
 parser = argparse.ArgumentParser(description="Concatenate files by exact name or prefix, submit to Slurm or run locally.")
@@ -79,21 +136,62 @@ parser.add_argument("--group-mode", choices=['exact', 'prefix'], default='exact'
 parser.add_argument("--read-style", choices=['r', 'R', 'r_', 'R_'], default='r', help="Output read style (default: r, e.g. r1)")
 parser.add_argument("--dry-run", action="store_true", help="Show planned actions, do not submit jobs")
 parser.add_argument("--local", action="store_true", help="Run locally instead of via Slurm")
-parser.add_argument("--parallel", type=int, default=4, help="Number of parallel jobs when using --local (default: 4)")
+parser.add_argument("--parallel", type=positive_int, default=4, help="Number of parallel jobs when using --local (default: 4)")
+parser.add_argument("--array-limit", type=positive_int, default=None, help="Maximum simultaneously running Slurm array tasks (default: no limit)")
+parser.add_argument("--max-array-size", type=positive_int, default=1001, help="Maximum tasks per Slurm array job, i.e. the cluster's MaxArraySize (default: 1001, the Slurm default)")
+parser.add_argument("--recompress", action="store_true", help="Recompress each group with pigz (1 MB blocks) instead of byte-wise concatenation")
+parser.add_argument("--threads", type=positive_int, default=None, help="pigz threads per concatenation with --recompress (default: cores / --parallel locally, 4 on Slurm)")
+parser.add_argument("--time", default=None, help="Slurm time limit per task (default: 00:15:00, or 04:00:00 with --recompress)")
 args = parser.parse_args()
 
+# pigz threads per concatenation (only used with --recompress). Locally the
+# cores are shared across the concurrent jobs; on Slurm this is the per-task
+# CPU request, since the submit host's core count says nothing about the nodes
+threads = None
+if args.recompress:
+    if args.threads:
+        threads = args.threads
+    elif args.local:
+        threads = max(1, (os.cpu_count() or 1) // args.parallel)
+    else:
+        threads = 4
+# Decompressing and recompressing takes far longer than cat
+time_limit = args.time or ('04:00:00' if args.recompress else '00:15:00')
+
 input_files = glob.glob(args.input_glob)
 if not input_files:
     print(f"No files found for input_glob: {args.input_glob}")
     sys.exit(1)
 
+# Drop duplicate inputs (symlinks or hard links to the same file), which
+# would otherwise be concatenated twice into the same output
+# First path seen for each (device, inode)
+seen = {}
+unique_files = []
+for f in sorted(input_files):
+    try:
+        st = os.stat(f)
+    except OSError as e:
+        # e.g. a dangling symlink matched by the glob
+        print(f"Error: Cannot read input file {f}: {e.strerror}")
+        sys.exit(1)
+    first = seen.get((st.st_dev, st.st_ino))
+    if first is not None:
+        print(f"Skipping {f}: same file as {first}")
+        continue
+    seen[(st.st_dev, st.st_ino)] = f
+    unique_files.append(f)
+input_files = unique_files
+
 # Check all files are .fq.gz or .fastq.gz
 for f in input_files:
     if not (f.endswith('.fq.gz') or f.endswith('.fastq.gz')):
         print(f"Error: File does not end with .fq.gz or .fastq.gz: {f}")
         sys.exit(1)
 
-groups = defaultdict(lambda: {"files": [], "outfile_name": None})
+# Input files and output filename per (group key, read)
+group_files = defaultdict(list)
+group_outnames = {}
 if args.group_mode == 'exact':
     for f in input_files:
         base = os.path.basename(f)
@@ -108,8 +206,8 @@ if args.group_mode == 'exact':
         else:
             outfile_name = base
         key = (base, read)
-        groups[key]["files"].append(f)
-        groups[key]["outfile_name"] = outfile_name
+        group_files[key].append(f)
+        group_outnames[key] = outfile_name
 elif args.group_mode == 'prefix':
     for f in input_files:
         base = os.path.basename(f)
@@ -122,10 +220,10 @@ elif args.group_mode == 'prefix':
         formatted_read = format_read(read, args.read_style)
         outfile_name = prefix + '_' + formatted_read + ".fq.gz"
         key = (prefix, read)
-        groups[key]["files"].append(f)
-        groups[key]["outfile_name"] = outfile_name
+        group_files[key].append(f)
+        group_outnames[key] = outfile_name
 
-print(f"Found {len(groups)} unique groups.")
+print(f"Found {len(group_files)} unique groups.")
 
 # Prepare output directory
 if not os.path.exists(args.outdir):
@@ -138,74 +236,101 @@ if not args.local and not args.dry_run:
     slurmlogs_dir = os.path.join(args.outdir, 'slurmlogs')
     os.makedirs(slurmlogs_dir, exist_ok=True)
 
-# For dry-run, collect summary and show only first example
 # For local mode, collect tasks to run in parallel
-shown_example = False
+# For Slurm mode, collect one manifest line per group for a single array job
 single_file_groups = []
 concat_count = 0
 tasks = []
+manifest_lines = []
 
-for idx, ((group_key, read), groupinfo) in enumerate(groups.items(), 1):
-    files = groupinfo["files"]
+for key, files in group_files.items():
+    orig_outfile_name = group_outnames[key]
     
     # Skip single-file groups (nothing to concatenate)
     if len(files) == 1:
-        single_file_groups.append((groupinfo["outfile_name"], files[0]))
+        single_file_groups.append((orig_outfile_name, files[0]))
         continue
     
     concat_count += 1
-    orig_outfile_name = groupinfo["outfile_name"]
-    # Reformat the read part in outfile_name according to --read-style
-    m = re.search(r'(r[_]?1|R[_]?1|r[_]?2|R[_]?2)', orig_outfile_name)
-    if m:
-        read_num = m.group(0)[-1]
-        new_read = format_read('r' + read_num, args.read_style)
-        out_base = orig_outfile_name[:m.start()] + new_read + orig_outfile_name[m.end():]
-    else:
-        # fallback: just append .fq.gz if not found
+    if args.group_mode == 'prefix':
+        # Already built as prefix + formatted read, nothing to reformat
         out_base = orig_outfile_name
+    else:
+        # Reformat the read part in outfile_name according to --read-style
+        m = _OUT_READ_RE.search(orig_outfile_name)
+        if m:
+            read_num = m.group(0)[-1]
+            new_read = format_read('r' + read_num, args.read_style)
+            out_base = orig_outfile_name[:m.start()] + new_read + orig_outfile_name[m.end():]
+        else:
+            # fallback: just append .fq.gz if not found
+            out_base = orig_outfile_name
     out_path = os.path.join(args.outdir, out_base)
-    files_str = " ".join(sorted(files))
+    sorted_files = sorted(files)
     
     print(f"{concat_count}. {out_base}: {len(files)} files")
         
-    cmd = f"cat {files_str} > {out_path}"
-    slurm_script = f"""#!/bin/bash
-#SBATCH --job-name=cat_{str(group_key).replace('.','_')}_{read}
-#SBATCH --output={os.path.join(args.outdir, 'slurmlogs', out_base)}.slurm.out
+    if args.local:
+        # Collect tasks for local execution
+        tasks.append((out_path, sorted_files, out_base, threads))
+    else:
+        # Array task concat_count - 1: output path, then the input files
+        manifest_lines.append("\t".join([out_path] + sorted_files))
+
+# Build Slurm array jobs covering every group, split so that no array exceeds
+# the cluster's MaxArraySize. Each submission gets its own manifest, so a second
+# run into the same outdir cannot rewrite it under a still-pending array
+array_jobs = 0
+if manifest_lines:
+    slurmlogs_dir = os.path.join(args.outdir, 'slurmlogs')
+    if args.recompress:
+        cmd = 'pigz -dc -p "$SLURM_CPUS_PER_TASK" "${SRCS[@]}" | pigz -c -p "$SLURM_CPUS_PER_TASK" -b 1024 > "$OUT"'
+    else:
+        cmd = 'cat "${SRCS[@]}" > "$OUT"'
+    array_limit = f"%{args.array_limit}" if args.array_limit else ""
+    for start in range(0, len(manifest_lines), args.max_array_size):
+        chunk = manifest_lines[start:start + args.max_array_size]
+        array_jobs += 1
+        if args.dry_run:
+            manifest_path = os.path.abspath(os.path.join(slurmlogs_dir, 'concat_tasks_XXXXXX.tsv'))
+        else:
+            fd, manifest_path = tempfile.mkstemp(prefix='concat_tasks_', suffix='.tsv', dir=slurmlogs_dir)
+            manifest_path = os.path.abspath(manifest_path)
+            with os.fdopen(fd, 'w') as mf:
+                mf.write("\n".join(chunk) + "\n")
+        slurm_script = f"""#!/bin/bash
+#SBATCH --job-name=cat_{os.path.basename(os.path.normpath(args.outdir))}
+#SBATCH --output={os.path.join(slurmlogs_dir, 'cat_%A_%a')}.slurm.out
+#SBATCH --array=0-{len(chunk) - 1}{array_limit}
 #SBATCH --mem=12G
-#SBATCH --cpus-per-task=1
-#SBATCH --time=00:15:00
+#SBATCH --cpus-per-task={threads or 1}
+#SBATCH --time={time_limit}
 
 set -euo pipefail
+mapfile -t TASKS < {shlex.quote(manifest_path)}
+IFS=$'\\t' read -r -a FIELDS <<< "${{TASKS[$SLURM_ARRAY_TASK_ID]}}"
+OUT="${{FIELDS[0]}}"
+SRCS=("${{FIELDS[@]:1}}")
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Starting concatenation"
-echo "Concatenating to {out_path}"
-echo "Running command: {cmd}"
+echo "Concatenating to $OUT"
+echo "Inputs: ${{SRCS[*]}}"
 {cmd}
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Finished concatenation"
 """
-    if args.dry_run:
-        if not shown_example:
-            print(f"\n[Example Slurm script for first group:]")
+        if args.dry_run:
+            print(f"\n[Slurm array script {array_jobs} ({len(chunk)} tasks, manifest: {manifest_path}):]")
             print(slurm_script)
-            shown_example = True
-    elif args.local:
-        # Collect tasks for local execution
-        tasks.append((out_path, files, out_base))
-    else:
-        # Slurm submission
-        import tempfile
-        with tempfile.NamedTemporaryFile("w", delete=False, suffix=".sh") as tf:
-            tf.write(slurm_script)
-            tf.flush()
-            subprocess.run(["sbatch", tf.name])
+        else:
+            # Slurm submission, sbatch reads the script from stdin
+            subprocess.run(["sbatch"], input=slurm_script, text=True)
 
 # Execute local tasks if in local mode
 if args.local and not args.dry_run and tasks:
     print(f"\nRunning {len(tasks)} concatenations locally with {args.parallel} parallel jobs...")
     
-    with Pool(processes=args.parallel) as pool:
-        results = pool.map(run_concat_local, tasks)
+    # Workers only wait on I/O or pigz, so threads are enough
+    with ThreadPoolExecutor(max_workers=args.parallel) as ex:
+        results = list(ex.map(run_concat_local, tasks))
     
     successful = sum(1 for success, _ in results if success)
     failed = len(results) - successful
@@ -218,12 +343,12 @@ if args.local and not args.dry_run and tasks:
                 print(f"  - {out_base}")
 
 if args.dry_run:
-    mode_str = "locally" if args.local else "Slurm jobs"
+    mode_str = "locally" if args.local else "Slurm array tasks"
     print(f"\n[DRY RUN] Would submit {concat_count} {mode_str} total.")
 elif args.local:
     print(f"\nCompleted {concat_count} concatenations locally.")
 else:
-    print(f"\nSubmitted {concat_count} Slurm jobs total.")
+    print(f"\nSubmitted {array_jobs} Slurm array job(s) with {concat_count} tasks total.")
 
 # Report single-file groups (no matches to concatenate)
 if single_file_groups:
@@ -1,75 +1,89 @@
+import math
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.stats import norm
+from matplotlib.colors import to_rgba_array
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from scipy.special import ndtri
 from plotting.sample_config import get_colors_for_samples
 
-def wilson_ci(count, denom, conf=0.95):
-    """Calculate Wilson score interval for binomial proportion."""
-    if denom == 0 or np.isnan(count) or np.isnan(denom):
-        return np.nan, np.nan
-    z = norm.ppf(1 - (1 - conf) / 2)
-    phat = count / denom
-    denom = float(denom)
-    center = (phat + z**2/(2*denom)) / (1 + z**2/denom)
-    margin = (z * np.sqrt(phat*(1-phat)/denom + z**2/(4*denom**2))) / (1 + z**2/denom)
+# Two-sided z quantiles by confidence level, 95% precomputed
+_Z_CACHE = {0.95: ndtri(0.975)}
+
+def _wilson_bounds(c, d, z):
+    """Closed-form Wilson bounds for 1-D float arrays; d is NaN where undefined."""
+    zz = z * z
+    inv_d = 1.0 / d
+    phat = c * inv_d
+    denom_corr = 1.0 + zz * inv_d
+    center = (phat + 0.5 * zz * inv_d) / denom_corr
+    margin = z * np.sqrt((phat * (1.0 - phat) + 0.25 * zz * inv_d) * inv_d) / denom_corr
     return center - margin, center + margin
 
-def plot_wilson_rate(
-    df, count_metric, denom_metric, samples, figsize=(8, 6), colors=None,
-    save_path=None, show_plot=False, show_counts=True
-):
+_wilson_kernel = None
+
+def _get_wilson_kernel():
     """
-    Plot rates (per billion) with 95% Wilson confidence intervals.
-    Error bars are straight lines.
-    Optionally show value labels for counts.
+    Return _wilson_bounds compiled with numba if available, else as is.
+    numba is imported on first use rather than at module import, as it is slow to load.
     """
-    fig, ax = plt.subplots(figsize=figsize, facecolor='white')
-    counts = df.loc[count_metric, samples]
-    denoms = df.loc[denom_metric, samples]
-    rates, lowers, uppers = [], [], []
-    for idx, (c, d) in enumerate(zip(counts, denoms)):
+    global _wilson_kernel
+    if _wilson_kernel is None:
         try:
-            c = float(c) if c not in ['', ' ', None] else np.nan
-            d = float(d) if d not in ['', ' ', None] else np.nan
-        except (ValueError, TypeError):
-            c, d = np.nan, np.nan
-        # print(f"Sample: {samples[idx]}, Count: {c}, Denom: {d}")
-        if np.isnan(c) or np.isnan(d) or d == 0:
-            rates.append(np.nan)
-            lowers.append(np.nan)
-            uppers.append(np.nan)
-            print(f"  Skipped (NaN or zero denominator)")
+            from numba import njit
+        except ImportError:  # numba is optional, fall back to plain NumPy
+            _wilson_kernel = _wilson_bounds
         else:
-            rate = (c / d) * 1e9  # per billion
-            lo, up = wilson_ci(c, d)
-            lo = lo * 1e9
-            up = up * 1e9
-            rates.append(rate)
-            lowers.append(lo)
-            uppers.append(up)
-            # print(f"  Rate per billion: {rate:.3e}, Wilson CI: [{lo:.3e}, {up:.3e}]")
-    if colors is None:
-        colors = get_colors_for_samples(samples)
-    else:
-        colors = colors[:len(samples)]
+            # Only FMA contraction is allowed since full fastmath assumes no
+            # NaNs, and NaN marks skipped samples here
+            _wilson_kernel = njit(cache=True, fastmath={'contract'})(_wilson_bounds)
+    return _wilson_kernel
+
+def wilson_ci(count, denom, conf=0.95):
+    """
+    Calculate Wilson score interval for binomial proportion.
+    Accepts scalars or arrays; NaN inputs or a zero denominator give NaN bounds.
+    """
+    count, denom = np.broadcast_arrays(np.asarray(count, dtype=np.float64), np.asarray(denom, dtype=np.float64))
+    shape = count.shape
+    count = np.ascontiguousarray(count).ravel()
+    denom = np.where(denom == 0, np.nan, denom).ravel()
+    z = _Z_CACHE.get(conf)
+    if z is None:
+        z = _Z_CACHE[conf] = ndtri(1 - (1 - conf) / 2)
+    lo, up = _get_wilson_kernel()(count, denom, float(z))
+    lo, up = lo.reshape(shape), up.reshape(shape)
+    # Scalar inputs give np.float64 bounds rather than 0-d arrays
+    return lo[()], up[()]
+
+@lru_cache(maxsize=32)
+def _cached_colors(samples):
+    """get_colors_for_samples memoized on a tuple of sample names, for repeated plots of one sample set."""
+    return tuple(get_colors_for_samples(list(samples)))
+
+def _draw_wilson_rate(ax, rates, lowers, uppers, samples, colors, count_metric, denom_metric, show_counts):
+    """Draw one panel of rates (per billion) with Wilson error bars onto ax."""
     x_pos = np.arange(len(samples))
-    bars = ax.bar(x_pos, rates, width=0.6, color=colors, edgecolor='black', linewidth=1.0, alpha=0.8)
-    # Error bars: straight lines, no whiskers
-    err_low = [r - l if not np.isnan(r) and not np.isnan(l) else 0 for r, l in zip(rates, lowers)]
-    err_up = [u - r if not np.isnan(r) and not np.isnan(u) else 0 for r, u in zip(rates, uppers)]
-    # print(f"Error bars (low): {err_low}")
-    # print(f"Error bars (up): {err_up}")
-    # Draw error bars as straight lines
-    for i, (rate, lo, up) in enumerate(zip(rates, lowers, uppers)):
-        if not np.isnan(rate) and not np.isnan(lo) and not np.isnan(up):
-            ax.plot([i, i], [lo, up], color='grey', linewidth=2)
-    # Value labels
+    # RGBA face/edge colours for every bar at alpha 0.8 (short colour lists cycle,
+    # as in ax.bar); skipped samples get a zero-height, fully transparent bar
+    missing = np.isnan(rates)
+    face_colors = np.resize(to_rgba_array(colors, alpha=0.8), (len(samples), 4))
+    edge_colors = np.resize(to_rgba_array('black', alpha=0.8), (len(samples), 4))
+    face_colors[missing, 3] = 0.0
+    edge_colors[missing, 3] = 0.0
+    heights = np.where(missing, 0.0, rates)
+    bars = ax.bar(x_pos, heights, width=0.6, color=face_colors, edgecolor=edge_colors, linewidth=1.0)
+    # Error bars: straight lines, no whiskers, one collection for all samples
+    valid = ~(np.isnan(rates) | np.isnan(lowers) | np.isnan(uppers))
+    ax.vlines(x_pos[valid], lowers[valid], uppers[valid], color='grey', linewidth=2, capstyle='projecting')
+    # Value labels, placed above each bar in one call (blank for skipped samples)
     if show_counts:
-        for i, (rate, c, d) in enumerate(zip(rates, counts, denoms)):
-            if not np.isnan(rate):
-                label = f'{rate:.0f}'
-                ax.text(i, rate + (np.nanmax(rates) * 0.02 if np.nanmax(rates) else 0), label, ha='center', va='bottom', fontsize=8)
+        labels = [f'{rate:.0f}' if not np.isnan(rate) else '' for rate in rates]
+        ax.bar_label(bars, labels=labels, padding=3, fontsize=8)
+    # Largest rate, for the y limit
+    max_rate = np.nanmax(rates) if np.any(~np.isnan(rates)) else 0.0
     ax.set_ylabel(f'Rate: {count_metric} / {denom_metric} (per 1e9)', fontsize=14, fontweight='bold')
     ax.set_xticks(x_pos)
     ax.set_xticklabels(samples, fontsize=12, fontweight='bold', rotation=45, ha='right')
@@ -78,16 +92,81 @@ def plot_wilson_rate(
     ax.spines['right'].set_visible(False)
     ax.spines['left'].set_linewidth(1.5)
     ax.spines['bottom'].set_linewidth(1.5)
-    if rates and np.nanmin(rates) >= 0:
+    if np.any(~missing) and np.nanmin(rates) >= 0:
         ax.set_ylim(bottom=0)
-    if rates and np.nanmax(rates) > 0:
-        ax.set_ylim(top=np.nanmax(rates) * 1.15)
+    if max_rate > 0:
+        ax.set_ylim(top=max_rate * 1.15)
     ax.tick_params(axis='x', length=0)
-    plt.tight_layout()
+
+def plot_wilson_rates(
+    df, pairs, samples, ncols=3, figsize=None, colors=None,
+    save_path=None, show_plot=False, show_counts=True
+):
+    """
+    Plot rates (per billion) with 95% Wilson confidence intervals for several
+    (count_metric, denom_metric) pairs, one subplot per pair in a single figure.
+    Rates and intervals for all pairs are computed together.
+    figsize defaults to 8 x 6 per subplot.
+    """
+    if not pairs:
+        return
+    # Count and denominator rows in one lookup and one coercion pass. pd.to_numeric
+    # already turns '', whitespace-only, None and unparseable cells into NaN
+    metrics = [p[0] for p in pairs] + [p[1] for p in pairs]
+    values = df.loc[metrics, samples].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    counts, denoms = values[:len(pairs)], values[len(pairs):]
+    skipped = np.isnan(counts) | np.isnan(denoms) | (denoms == 0)
+    for (count_metric, denom_metric), skip in zip(pairs, skipped):
+        if skip.any():
+            print(f"  {count_metric} / {denom_metric}: Skipped (NaN or zero denominator): {', '.join(str(s) for s, sk in zip(samples, skip) if sk)}")
+    # Rates and Wilson bounds for every pair and sample at once (per billion), NaN where skipped
+    rates = counts / np.where(denoms == 0, np.nan, denoms) * 1e9
+    lowers, uppers = wilson_ci(counts, denoms)
+    lowers = lowers * 1e9
+    uppers = uppers * 1e9
+    # Nothing to draw: skip all figure work (no file is saved)
+    if not np.any(np.isfinite(rates)):
+        print("  No finite rates to plot, skipping figure")
+        return None
+    if colors is None:
+        colors = list(_cached_colors(tuple(samples)))
+    else:
+        colors = colors[:len(samples)]
+    ncols = min(ncols, len(pairs))
+    nrows = math.ceil(len(pairs) / ncols)
+    if figsize is None:
+        figsize = (8 * ncols, 6 * nrows)
+    if show_plot:
+        fig, axes = plt.subplots(nrows, ncols, figsize=figsize, facecolor='white', squeeze=False)
+    else:
+        # Save-only: build the figure on an Agg canvas outside pyplot, so no
+        # interactive backend or pyplot figure bookkeeping is involved
+        fig = Figure(figsize=figsize, facecolor='white')
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(nrows, ncols, squeeze=False)
+    for ax, (count_metric, denom_metric), r, lo, up in zip(axes.flat, pairs, rates, lowers, uppers):
+        _draw_wilson_rate(ax, r, lo, up, samples, colors, count_metric, denom_metric, show_counts)
+    # Hide unused cells of the last row
+    for ax in axes.flat[len(pairs):]:
+        ax.set_visible(False)
+    fig.tight_layout()
     if save_path:
-        plt.savefig(save_path, dpi=300, bbox_inches='tight', facecolor='white', edgecolor='none')
+        fig.savefig(save_path, dpi=300, bbox_inches='tight', facecolor='white', edgecolor='none')
     if show_plot:
         plt.show()
-    plt.close()
+        plt.close(fig)
     return
 
+def plot_wilson_rate(
+    df, count_metric, denom_metric, samples, figsize=(8, 6), colors=None,
+    save_path=None, show_plot=False, show_counts=True
+):
+    """
+    Plot rates (per billion) with 95% Wilson confidence intervals.
+    Error bars are straight lines.
+    Optionally show value labels for counts.
+    """
+    return plot_wilson_rates(
+        df, [(count_metric, denom_metric)], samples, ncols=1, figsize=figsize, colors=colors,
+        save_path=save_path, show_plot=show_plot, show_counts=show_counts
+    )